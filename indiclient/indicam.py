@@ -5,19 +5,76 @@
 Classes and utility functions for communicating with cameras via the INDI protocol, http://www.indilib.org.
 """
 
+import asyncio
+import re
 import time
-import io
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 import logging
 import logging.handlers
 
-from astropy.io import fits
-
-from .indiclient import indiclient
+from .indiclient import indiclient, indimessage
 
 log = logging.getLogger("")
 log.setLevel(logging.INFO)
 
+# precompiled matcher for driver error messages checked in the expose receive loop
+_err_search = re.compile(r"\b(ERROR|FATAL)\b").search
+
+# pre-bound callable for the expose receive loop so each pass skips the
+# module and attribute lookups
+_time = time.time
+
+
+def _fits_fromstring(data):
+    """
+    Parse FITS data from bytes, importing astropy on first use. Loading astropy.io.fits
+    pulls in numpy and friends, which costs hundreds of ms that clients that never take
+    an exposure (connection monitoring, filter control) shouldn't pay at import time.
+    The first call rebinds this name to fits.HDUList.fromstring, so later exposures go
+    straight to astropy with no indirection.
+    """
+    global _fits_fromstring
+    from astropy.io import fits
+    _fits_fromstring = fits.HDUList.fromstring
+    return _fits_fromstring(data)
+
+
+def _asint(v):
+    """
+    Cheap int coercion that skips the constructor when the value is already an int
+    """
+    return v if type(v) is int else int(v)
+
+
+class InvalidExpTypeError(ValueError):
+    """
+    Raised when an exposure type is not one of the frame types the camera offers.
+    The message is built lazily in __str__ so the non-error path never formats it.
+    """
+    def __init__(self, exptype, frame_types):
+        super(InvalidExpTypeError, self).__init__()
+        self.exptype = exptype
+        self.frame_types = frame_types
+
+    def __str__(self):
+        return "Invalid exposure type, %s. Must be one of %s'." % (self.exptype, repr(self.frame_types))
+
+
+class InvalidExpTimeError(ValueError):
+    """
+    Raised when an exposure time falls outside the range the camera accepts.
+    The message is built lazily in __str__ so the non-error path never formats it.
+    """
+    def __init__(self, exptime):
+        super(InvalidExpTimeError, self).__init__()
+        self.exptime = exptime
+
+    def __str__(self):
+        return "Invalid exposure time, %f. Must be >= 0 and <= 3600 sec." % self.exptime
+
 
 class CCDCam(indiclient):
     """
@@ -27,22 +84,110 @@ class CCDCam(indiclient):
     def __init__(self, host, port, driver="CCD Simulator", debug=True):
         super(CCDCam, self).__init__(host, port)
         self.camera_name = "MMTO Default"
+        # zero-copy view of the name-keyed vector mapping maintained by the base class
+        self.vector_dict = self.indivectors.by_name
+        self._elem_cache = {}
+        self._conn_element = None
+        # single worker that turns raw BLOBs into HDULists, so a caller can command
+        # the next exposure while the previous frame is still being parsed
+        self._parse_pool = ThreadPoolExecutor(max_workers=1)
         self.enable_blob()
         self.driver = driver
         self.debug = debug
+        if debug:
+            log.setLevel(logging.DEBUG)
+        # specialize the debug tell sites once so the non-debug hot paths pay a
+        # single no-op call instead of a flag check per vector; the diagnostics
+        # follow the logger level, so handlers configured above DEBUG skip all
+        # per-vector formatting
+        if log.isEnabledFor(logging.DEBUG):
+            self._dbg_tell = lambda vec: vec.tell() if vec is not None else None
+        else:
+            self._dbg_tell = lambda vec: None
         if not self.connected:
             self.connect()
-            time.sleep(2)
+            self._wait_for_properties()
 
         # run this to clear any queued events
         self.process_events()
         self.defvectorlist = []
-        self.vector_dict = {v.name: v for v in self.indivectors.list}
 
-    @property
+    def _wait_for_properties(self, vectorname="CCD_INFO", timeout=5.0):
+        """
+        Block until the driver has defined the named vector after a connect, rather than
+        sleeping for a fixed settle interval. Typically returns well under a second on a
+        local server; logs a warning and gives up after the timeout.
+        """
+        t0 = _time()
+        while vectorname not in self.vector_dict:
+            remaining = timeout - (_time() - t0)
+            if remaining <= 0.0:
+                log.warning("Timed out waiting for %s to be defined." % vectorname)
+                break
+            self._vector_ready.clear()
+            self.process_receive_vector_queue()
+            if vectorname in self.vector_dict:
+                break
+            self.wait_for_vector(timeout=remaining)
+
+    def get_vector(self, devicename, vectorname):
+        """
+        Look the vector up in the local name cache before falling back to the linear scan
+        in the base class. Received updates are applied to the stored vector objects in
+        place, so cached references stay current.
+        """
+        vector = self.vector_dict.get(vectorname)
+        if vector is not None and vector.device == devicename:
+            return vector
+        vector = super(CCDCam, self).get_vector(devicename, vectorname)
+        if vector is not None:
+            self.vector_dict[vectorname] = vector
+        return vector
+
+    def _element(self, devicename, vectorname, elementname):
+        """
+        Look an element up via a (vector, element) name cache so repeated scalar reads
+        skip the per-element scan of the vector.
+        """
+        key = (vectorname, elementname)
+        element = self._elem_cache.get(key)
+        if element is None:
+            vector = self.get_vector(devicename, vectorname)
+            if vector is None:
+                return None
+            element = vector.get_element(elementname)
+            if element is not None:
+                self._elem_cache[key] = element
+        return element
+
+    def get_float(self, devicename, vectorname, elementname):
+        try:
+            num = self._element(devicename, vectorname, elementname).get_float()
+        except Exception as e:
+            log.error("Can't get float from bogus vector: %s" % e)
+            num = None
+        return num
+
+    def get_text(self, devicename, vectorname, elementname):
+        try:
+            text = self._element(devicename, vectorname, elementname).get_text()
+        except Exception as e:
+            log.error("Can't get text from bogus vector: %s" % e)
+            text = None
+        return text
+
+    def _invalidate_caches(self):
+        """
+        Drop the cached hardware-fixed properties so they get re-queried from the driver
+        """
+        for name in ("ccd_info", "frame_types", "_frame_type_set", "filters", "_filter_index"):
+            self.__dict__.pop(name, None)
+
+    @cached_property
     def ccd_info(self):
         """
-        Get the CCD info about pixel sizes and bits per pixel, etc.
+        Get the CCD info about pixel sizes and bits per pixel, etc. Fixed per camera, so
+        cached after the first read; invalidated on connect/disconnect.
         """
         info_vec = self.get_vector(self.driver, "CCD_INFO")
         info = {}
@@ -54,12 +199,17 @@ class CCDCam(indiclient):
     def connected(self):
         """
         Check connection status and return True if connected, False otherwise.
-        """
-        status = self.get_text(self.driver, "CONNECTION", "CONNECT")
-        if status == 'On':
-            return True
-        else:
-            return False
+        Resolves the CONNECT element once and keeps the handle; set updates are applied
+        to the element in place, so rereading it stays current without walking the
+        property tree on every poll.
+        """
+        element = self._conn_element
+        if element is None:
+            element = self._element(self.driver, "CONNECTION", "CONNECT")
+            self._conn_element = element
+            if element is None:
+                return False
+        return element.get_text() == 'On'
 
     @property
     def observer(self):
@@ -81,7 +231,8 @@ class CCDCam(indiclient):
 
     @property
     def temperature(self):
-        self.process_events()
+        # apply any pending vector updates without dispatching the full event machinery
+        self.process_receive_vector_queue()
         t = self.get_float(self.driver, "CCD_TEMPERATURE", "CCD_TEMPERATURE_VALUE")
         return t
 
@@ -94,7 +245,7 @@ class CCDCam(indiclient):
 
     @property
     def cooling_power(self):
-        self.process_events()
+        self.process_receive_vector_queue()
         power = self.get_float(self.driver, "CCD_COOLER_POWER", "CCD_COOLER_VALUE")
         return power
 
@@ -108,19 +259,34 @@ class CCDCam(indiclient):
         fan = self.get_text(self.driver, "CCD_FAN", "FAN_ON")
         return fan
 
-    @property
+    @cached_property
     def frame_types(self):
         types = [e.label for e in self.get_vector(self.driver, "CCD_FRAME_TYPE").elements]
         return types
 
-    @property
+    @cached_property
+    def _frame_type_set(self):
+        """
+        Hashed view of frame_types so per-exposure validation is an O(1) membership test
+        """
+        return frozenset(self.frame_types)
+
+    @cached_property
     def filters(self):
         """
-        Return list of names of installed filters
+        Return list of names of installed filters. Fixed per session, so cached after
+        the first read; invalidated on connect/disconnect.
         """
         filters = [e.get_text() for e in self.get_vector(self.driver, "FILTER_NAME").elements]
         return filters
 
+    @cached_property
+    def _filter_index(self):
+        """
+        Mapping of filter name to 0-indexed slot, built alongside filters
+        """
+        return {f: i for i, f in enumerate(self.filters)}
+
     @property
     def filter(self):
         slot = int(self.get_float(self.driver, "FILTER_SLOT", "FILTER_SLOT_VALUE")) - 1  # filter slots 1-indexed
@@ -136,8 +302,9 @@ class CCDCam(indiclient):
             if f >= 0 and f < len(self.filters):
                 self.set_and_send_float(self.driver, "FILTER_SLOT", "FILTER_SLOT_VALUE", f+1)
         else:
-            if f in self.filters:
-                self.set_and_send_float(self.driver, "FILTER_SLOT", "FILTER_SLOT_VALUE", self.filters.index(f)+1)
+            slot = self._filter_index.get(f)
+            if slot is not None:
+                self.set_and_send_float(self.driver, "FILTER_SLOT", "FILTER_SLOT_VALUE", slot+1)
 
     @property
     def binning(self):
@@ -156,30 +323,32 @@ class CCDCam(indiclient):
         """
         Set binning from a dict of form of e.g. {'X':2, 'Y':2}
         """
+        updates = {}
         if 'X' in bindict:
             if bindict['X'] >= 1:
-                self.set_and_send_float(self.driver, "CCD_BINNING", "HOR_BIN", int(bindict['X']))
-                log.info("Setting X binning to %d" % int(bindict['X']))
+                updates['HOR_BIN'] = _asint(bindict['X'])
+                log.info("Setting X binning to %d" % updates['HOR_BIN'])
 
         if 'Y' in bindict:
             if bindict['Y'] >= 1:
-                self.set_and_send_float(self.driver, "CCD_BINNING", "VER_BIN", int(bindict['Y']))
-                log.info("Setting Y binning to %d" % int(bindict['Y']))
+                updates['VER_BIN'] = _asint(bindict['Y'])
+                log.info("Setting Y binning to %d" % updates['VER_BIN'])
+
+        if updates:
+            self.set_and_send_floats(self.driver, "CCD_BINNING", updates)
 
     @property
     def frame(self):
         """
         Get the frame configuration of the CCD: X lower, Y lower, width, and height
         """
-        xl = self.get_float(self.driver, "CCD_FRAME", "X")
-        yl = self.get_float(self.driver, "CCD_FRAME", "Y")
-        xu = self.get_float(self.driver, "CCD_FRAME", "WIDTH")
-        yu = self.get_float(self.driver, "CCD_FRAME", "HEIGHT")
+        frame_vec = self.get_vector(self.driver, "CCD_FRAME")
+        vals = {e.getName(): e.get_float() for e in frame_vec.elements}
         frame_info = {
-            'X': xl,
-            'Y': yl,
-            'width': xu,
-            'height': yu
+            'X': vals['X'],
+            'Y': vals['Y'],
+            'width': vals['WIDTH'],
+            'height': vals['HEIGHT']
         }
         return frame_info
 
@@ -194,33 +363,46 @@ class CCDCam(indiclient):
             "height": int - height of the readout region
         }
         """
-        ccdinfo = self.ccd_info
+        self._set_frame(framedict)
+
+    def _set_frame(self, framedict, ccdinfo=None):
+        """
+        Implementation of the frame setter that can reuse an already-fetched ccd_info dict
+        """
+        if ccdinfo is None:
+            ccdinfo = self.ccd_info
+        updates = {}
         if 'X' in framedict:
             if framedict['X'] >= 0 and framedict['X'] <= ccdinfo['CCD_MAX_X']:
-                self.set_and_send_float(self.driver, "CCD_FRAME", "X", int(framedict['X']))
-                log.info("Setting lower X to %d" % int(framedict['X']))
+                updates['X'] = _asint(framedict['X'])
+                log.info("Setting lower X to %d" % updates['X'])
                 if 'width' in framedict:
                     newwidth = min(framedict['width'], ccdinfo['CCD_MAX_X']-framedict['X'])
                     if newwidth >= 1:
-                        self.set_and_send_float(self.driver, "CCD_FRAME", "WIDTH", int(newwidth))
-                        log.info("Setting width to %d" % int(newwidth))
+                        updates['WIDTH'] = _asint(newwidth)
+                        log.info("Setting width to %d" % updates['WIDTH'])
         if 'Y' in framedict:
             if framedict['Y'] >= 0 and framedict['Y'] <= ccdinfo['CCD_MAX_Y']:
-                self.set_and_send_float(self.driver, "CCD_FRAME", "Y", int(framedict['Y']))
-                log.info("Setting lower Y to %d" % int(framedict['Y']))
+                updates['Y'] = _asint(framedict['Y'])
+                log.info("Setting lower Y to %d" % updates['Y'])
                 if 'height' in framedict:
                     newheight = min(framedict['height'], ccdinfo['CCD_MAX_Y']-framedict['Y'])
                     if newheight >= 1:
-                        self.set_and_send_float(self.driver, "CCD_FRAME", "HEIGHT", int(newheight))
-                        log.info("Setting height to %d" % int(newheight))
+                        updates['HEIGHT'] = _asint(newheight)
+                        log.info("Setting height to %d" % updates['HEIGHT'])
+        if updates:
+            self.set_and_send_floats(self.driver, "CCD_FRAME", updates)
 
     def connect(self):
         """
         Enable camera connection
         """
+        if self.connected:
+            # already in the requested state; skip the round-trip to the server
+            return self.get_vector(self.driver, "CONNECTION")
+        self._invalidate_caches()
         vec = self.set_and_send_switchvector_by_elementlabel(self.driver, "CONNECTION", "Connect")
-        if self.debug and vec is not None:
-            vec.tell()
+        self._dbg_tell(vec)
         self.process_events()
         return vec
 
@@ -228,18 +410,23 @@ class CCDCam(indiclient):
         """
         Disable camera connection
         """
+        if not self.connected:
+            # already in the requested state; skip the round-trip to the server
+            return self.get_vector(self.driver, "CONNECTION")
+        self._invalidate_caches()
         vec = self.set_and_send_switchvector_by_elementlabel(self.driver, "CONNECTION", "Disconnect")
-        if self.debug:
-            vec.tell()
+        self._dbg_tell(vec)
         return vec
 
     def _default_def_handler(self, vector, indi):
         """
-        Overload the default vector handler to do a vector.tell() so it's clear what's going on
+        Overload the default vector handler to do a vector.tell() so it's clear what's going on.
+        Cached vector and element references are deliberately left alone here: the base
+        class applies definitions and updates to the stored vector objects in place, so
+        cached references never go stale, and dropping them on every definition would
+        empty the name caches right after connection set-up fills them.
         """
-        if self.debug:
-            vector.tell()
-        pass
+        self._dbg_tell(vector)
 
     def cooling_on(self):
         """
@@ -257,57 +444,140 @@ class CCDCam(indiclient):
         self.process_events()
         return c_vec
 
+    def _parse_blob(self, blob_vector):
+        """
+        Turn a received BLOB vector into an HDUList with the local header keys filled
+        in. Runs on the parse worker so exposures can be pipelined; parsing eagerly
+        means later header/data access never reparses the buffer.
+        """
+        blob = blob_vector.get_first_element()
+        if blob.get_plain_format() != ".fits":
+            return None
+        fitsdata = _fits_fromstring(blob.get_data())
+        for hdu in fitsdata:
+            hdu.data
+        if 'FILTER' not in fitsdata[0].header:
+            fitsdata[0].header['FILTER'] = self.filter
+        fitsdata[0].header['CAMERA'] = self.camera_name
+        return fitsdata
+
     def expose(self, exptime=1.0, exptype="Light"):
         """
         Take exposure and return FITS data
         """
-        if exptype not in self.frame_types:
-            raise Exception("Invalid exposure type, %s. Must be one of %s'." % (exptype, repr(self.frame_types)))
+        if exptype not in self._frame_type_set:
+            raise InvalidExpTypeError(exptype, self.frame_types)
 
         if exptime < 0.0 or exptime > 3600.0:
-            raise Exception("Invalid exposure time, %f. Must be >= 0 and <= 3600 sec." % exptime)
-
-        ft_vec = self.set_and_send_switchvector_by_elementlabel(self.driver, "CCD_FRAME_TYPE", exptype)
-        if self.debug:
-            ft_vec.tell()
+            raise InvalidExpTimeError(exptime)
+
+        # register before the commands go out so the BLOB cannot slip past between
+        # the send and the wait; the receiver thread hands the image vector straight
+        # to this waiter instead of queueing it with every other event
+        waiter = self.register_blob_waiter(self.driver)
+        try:
+            # stage both start-of-exposure vectors locally and push them in one socket
+            # write so they cross the wire in a single segment
+            ft_vec = self.get_vector(self.driver, "CCD_FRAME_TYPE")
+            if ft_vec is not None:
+                ft_vec.set_by_elementlabel(exptype)
+            exp_vec = self.get_vector(self.driver, "CCD_EXPOSURE")
+            if exp_vec is not None:
+                exp_vec.get_element("CCD_EXPOSURE_VALUE").set_float(exptime)
+            self.send_vectors((ft_vec, exp_vec))
+            self._dbg_tell(ft_vec)
+            self._dbg_tell(exp_vec)
+
+            self.defvectorlist = []
+            blob_vector = self.wait_for_blob(waiter, timeout=exptime + 10.0)
+        finally:
+            self.unregister_blob_waiter(self.driver)
 
-        exp_vec = self.set_and_send_float(self.driver, "CCD_EXPOSURE", "CCD_EXPOSURE_VALUE", exptime)
-        if self.debug:
-            exp_vec.tell()
-
-        self.defvectorlist = []
         fitsdata = None
-        run = True
+        if blob_vector is None:
+            log.warning("Exposure timed out.")
+        else:
+            log.info("Reading FITS image out...")
+            fitsdata = self._parse_pool.submit(self._parse_blob, blob_vector).result()
+
+        # apply state updates that arrived during the exposure and log any driver messages
+        self.process_receive_vector_queue()
+        for vector in self.drain_event_queue():
+            if type(vector) is indimessage:
+                msg = vector.get_text()
+                if _err_search(msg):
+                    log.error(msg)
+                else:
+                    log.info(msg)
+        return fitsdata
 
-        t = time.time()
-        timeout = exptime + 10.0
+    def expose_many(self, exptimes, exptype="Light"):
+        """
+        Take a series of back-to-back exposures, yielding the FITS data for each frame
+        in order. Each frame's BLOB is handed to the parse worker as soon as it
+        arrives and the result is collected while the following frame integrates, so
+        the parse and transfer overhead is hidden behind the next exposure instead of
+        serializing with it. Frames that time out yield None.
+        """
+        if exptype not in self._frame_type_set:
+            raise InvalidExpTypeError(exptype, self.frame_types)
 
-        while run:
-            self.process_receive_vector_queue()
-            while self.receive_event_queue.empty() is False:
-                vector = self.receive_event_queue.get()
-                if vector.tag.get_type() == "BLOBVector":
-                    log.info("Reading FITS image out...")
-                    blob = vector.get_first_element()
-                    if blob.get_plain_format() == ".fits":
-                        buf = io.BytesIO(blob.get_data())
-                        fitsdata = fits.open(buf)
-                        if 'FILTER' not in fitsdata[0].header:
-                            fitsdata[0].header['FILTER'] = self.filter
-                        fitsdata[0].header['CAMERA'] = self.camera_name
-                    run = False
-                    break
-                if vector.tag.get_type() == "message":
-                    msg = vector.get_text()
-                    if "ERROR" in msg:
-                        log.error(msg)
-                    else:
-                        log.info(msg)
-            if ((time.time() - t) > timeout):
+        exptimes = list(exptimes)
+        for exptime in exptimes:
+            if exptime < 0.0 or exptime > 3600.0:
+                raise InvalidExpTimeError(exptime)
+
+        # the frame type holds for the whole series, so send it once up front
+        ft_vec = self.set_and_send_switchvector_by_elementlabel(self.driver, "CCD_FRAME_TYPE", exptype)
+        self._dbg_tell(ft_vec)
+        self.defvectorlist = []
+        return self._expose_frames(exptimes)
+
+    def _expose_frames(self, exptimes):
+        """
+        The per-frame generator behind expose_many(). Kept separate so that
+        expose_many() itself is a plain method: its argument validation raises as soon
+        as it is called, like expose(), rather than on the first next().
+        """
+        prev = None
+        first = True
+        for exptime in exptimes:
+            waiter = self.register_blob_waiter(self.driver)
+            try:
+                exp_vec = self.set_and_send_float(self.driver, "CCD_EXPOSURE", "CCD_EXPOSURE_VALUE", exptime)
+                self._dbg_tell(exp_vec)
+                blob_vector = self.wait_for_blob(waiter, timeout=exptime + 10.0)
+            finally:
+                self.unregister_blob_waiter(self.driver)
+            if blob_vector is None:
                 log.warning("Exposure timed out.")
-                break
-            time.sleep(0.1)
-        return fitsdata
+                future = None
+            else:
+                future = self._parse_pool.submit(self._parse_blob, blob_vector)
+            if not first:
+                yield prev.result() if prev is not None else None
+            prev = future
+            first = False
+        if not first:
+            yield prev.result() if prev is not None else None
+
+        # apply state updates that arrived during the series and log any driver messages
+        self.process_receive_vector_queue()
+        for vector in self.drain_event_queue():
+            if type(vector) is indimessage:
+                msg = vector.get_text()
+                if _err_search(msg):
+                    log.error(msg)
+                else:
+                    log.info(msg)
+
+    async def expose_async(self, exptime=1.0, exptype="Light"):
+        """
+        Take exposure and return FITS data without blocking the calling event loop.
+        The blocking expose() runs in a worker thread, so exposures on several cameras
+        can proceed concurrently by awaiting their expose_async() calls in one loop.
+        """
+        return await asyncio.to_thread(self.expose, exptime=exptime, exptype=exptype)
 
 
 class ASICam(CCDCam):
@@ -413,7 +683,8 @@ class MATCam(CCDCam):
         self.camera_name = "MATcam"
         self.process_events()
 
-        time.sleep(1)
+        # wait for the filter wheel enabled above to report its filter set
+        self._wait_for_properties("FILTER_NAME")
 
     def enable_cfw(self):
         type_vec = self.set_and_send_switchvector_by_elementlabel(self.driver, "CFW_TYPE", "CFW-402")
@@ -435,7 +706,7 @@ class F9WFSCam(CCDCam):
         super(F9WFSCam, self).__init__(host, port, driver="SBIG CCD")
         self.camera_name = "F/9 WFS"
         self.connect()
-        time.sleep(1)
+        self._wait_for_properties()
         self.process_events()
 
     @property
@@ -486,7 +757,7 @@ class F9WFSCam(CCDCam):
             'width': int(ccdinfo['CCD_MAX_X']),
             'height': int(ccdinfo['CCD_MAX_Y'])
         }
-        self.frame = framedict
+        self._set_frame(framedict, ccdinfo)
 
     def wfs_subim(self):
         ccdinfo = self.ccd_info
@@ -499,7 +770,7 @@ class F9WFSCam(CCDCam):
             'width': int(ccdinfo['CCD_MAX_Y']),
             'height': int(ccdinfo['CCD_MAX_Y'])
         }
-        self.frame = framedict
+        self._set_frame(framedict, ccdinfo)
 
     def wfs_config(self):
         """
@@ -29,6 +29,7 @@ An INDI Client Library
 import socket
 import xml.parsers.expat
 import base64
+import binascii
 import sys
 import os
 import threading
@@ -398,6 +399,8 @@ class indipermissions:
     @type perm : StringType
     """
 
+    __slots__ = ("perm",)
+
     def __init__(self, perm):
         """
         @param perm : The users read/write permissions for the  vector possible values are:
@@ -447,6 +450,8 @@ class indiobject:
     @type tag: L{indixmltag}
     """
 
+    __slots__ = ("tag",)
+
     def __init__(self, attrs, tag):
         """
         @param tag: The XML tag of the vector (see L{indixmltag}).
@@ -504,6 +509,8 @@ class indinamedobject(indiobject):
     @type label : StringType
     """
 
+    __slots__ = ("name", "label")
+
     def __init__(self, attrs, tag):
         """
         @param tag: The XML tag of the object (see L{indixmltag}).
@@ -512,7 +519,10 @@ class indinamedobject(indiobject):
         @type attrs: DictType
         """
         indiobject.__init__(self, attrs, tag)
-        name = attrs.get('name', "").strip()
+        # names recur for every update of the same property, so interning them
+        # deduplicates the strings and lets dict lookups and comparisons against
+        # the (already interned) literals in client code short-cut on identity
+        name = sys.intern(attrs.get('name', "").strip())
         label = attrs.get('label', "").strip()
         self.name = name
         if label == "":
@@ -534,6 +544,8 @@ class indielement(indinamedobject):
     @type _old_value : StringType
     """
 
+    __slots__ = ("_value", "_old_value")
+
     def __init__(self, attrs, tag):
         indinamedobject.__init__(self, attrs, tag)
         self._set_value('')
@@ -618,6 +630,8 @@ class indinumber(indielement):
     @type _step : StringType
     """
 
+    __slots__ = ("format", "_min", "_max", "_step")
+
     def __init__(self, attrs, tag):
         self._value = ""
         indielement.__init__(self, attrs, tag)
@@ -781,6 +795,8 @@ class indinumber(indielement):
 class inditext(indielement):
     """a (nearly) arbitrary text"""
 
+    __slots__ = ()
+
 
 class indilight(indielement):
     """
@@ -793,6 +809,8 @@ class indilight(indielement):
     @type _value : StringType
     """
 
+    __slots__ = ()
+
     def __init__(self, attrs, tag):
         self._value = ""
         indielement.__init__(self, attrs, tag)
@@ -867,6 +885,8 @@ class indilight(indielement):
 class indiswitch(indielement):
     """a switch that can be either C{On} or C{Off}"""
 
+    __slots__ = ()
+
     def get_active(self):
         """
         @return: a Boolean representing the state of the switch:
@@ -900,26 +920,41 @@ class indiblob(indielement):
     @type format : StringType
     """
 
+    __slots__ = ("format", "_data")
+
     def __init__(self, attrs, tag):
         indielement.__init__(self, attrs, tag)
         self.format = attrs.get('format', "").strip()
+        self._data = None
+
+    def _set_data(self, data):
+        """
+        Stores the plain binary version of the BLOB directly. Used by the parser, which
+        base64-decodes the data in chunks as it arrives so the encoded text never has to
+        be held in memory as one big string.
+        @param data:  The decoded binary data
+        @type data: BytesType
+        @return: B{None}
+        @rtype: NoneType
+        """
+        self._data = data
 
     def _get_decoded_value(self):
         """
         Decodes the value of the BLOB it does the base64 decoding as well as zlib decompression.
         zlib decompression is done only if the current L{format} string ends with C{.z}.
-        base64 decoding is always done.
+        base64 decoding is skipped when the parser has already streamed the decoded data in.
         @return: the decoded version of value
         @rtype: StringType
         """
-        value = self._value.encode("utf8")
+        if self._data is not None:
+            value = self._data
+        else:
+            value = binascii.a2b_base64(self._value.encode("utf8"))
         if len(self.format) >= 2:
             if self.format[len(self.format) - 2] + self.format[len(self.format) - 1] == ".z":
-                return zlib.decompress(base64.decodebytes(value))
-            else:
-                return base64.decodebytes(value)
-        else:
-            return base64.decodebytes(value)
+                return zlib.decompress(value)
+        return value
 
     def _encode_and_set_value(self, value, format):
         """
@@ -936,11 +971,11 @@ class indiblob(indielement):
         self.format = format
         if len(self.format) >= 2:
             if self.format[len(self.format) - 2] + self.format[len(self.format) - 1] == ".z":
-                self._set_value(base64.encodestring(zlib.compress(value)))
+                self._set_value(base64.encodebytes(zlib.compress(value)))
             else:
-                self._set_value(base64.encodestring(value))
+                self._set_value(base64.encodebytes(value))
         else:
-            self._set_value(base64.encodestring(value))
+            self._set_value(base64.encodebytes(value))
 
     def get_plain_format(self):
         """
@@ -1020,6 +1055,7 @@ class indiblob(indielement):
 
     def updateByElement(self, element):
         self._set_value(element._value)
+        self._data = element._data
         self.format = element.format
 
 
@@ -1054,6 +1090,9 @@ class indivector(indinamedobject):
     @type _message  : L{indimessage}
     """
 
+    __slots__ = ("device", "timestamp", "timeout", "_light", "group", "_perm",
+                 "_message", "elements", "port", "host")
+
     def __init__(self, attrs, tag):
         """
         @param attrs: The attributes of the XML version of the INDI vector.
@@ -1062,7 +1101,7 @@ class indivector(indinamedobject):
         @type tag: L{indixmltag}
         """
         indinamedobject.__init__(self, attrs, tag)
-        self.device = attrs.get('device', "").strip()
+        self.device = sys.intern(attrs.get('device', "").strip())
         self.timestamp = attrs.get('timestamp', "").strip()
         self.timeout = attrs.get('timeout', "").strip()
         self._light = indilight(attrs, tag)
@@ -1227,6 +1266,8 @@ class indiswitchvector(indivector):
     @type rule: StringType
     """
 
+    __slots__ = ("rule",)
+
     def __init__(self, attrs, tag):
         indivector.__init__(self, attrs, tag)
         self.rule = attrs.get('rule', "").strip()
@@ -1318,18 +1359,26 @@ class indiswitchvector(indivector):
 class indinumbervector(indivector):
     """A vector of numbers """
 
+    __slots__ = ()
+
 
 class indiblobvector(indivector):
     """A vector of BLOBs """
 
+    __slots__ = ()
+
 
 class inditextvector(indivector):
     """A vector of texts"""
 
+    __slots__ = ()
+
 
 class indilightvector(indivector):
     """A vector of lights """
 
+    __slots__ = ()
+
     def __init__(self, attrs, tag):
         self.tag = tag
         newattrs = attrs.copy()
@@ -1353,6 +1402,8 @@ class indimessage(indiobject):
     @type _value: StringType
     """
 
+    __slots__ = ("device", "timestamp", "_value")
+
     def __init__(self, attrs):
         """
         @param attrs: The attributes of the XML version of the INDI message.
@@ -1360,7 +1411,7 @@ class indimessage(indiobject):
         """
         tag = indixmltag(False, False, True, None, inditransfertypes.inew)
         indiobject.__init__(self, attrs, tag)
-        self.device = attrs.get('device', "").strip()
+        self.device = sys.intern(attrs.get('device', "").strip())
         self.timestamp = attrs.get('timestamp', "").strip()
         self._value = attrs.get('message', "").strip()
 
@@ -1389,10 +1440,13 @@ class indimessage(indiobject):
 
 class _indilist(list):
     """" A list with a more sophisticated append() function.
-    It checks for the existence an object with the same name overwrites it, if there is one. Will become a dictionary  soon :-)"""
+    It checks for the existence an object with the same name overwrites it, if there is one.
+    A name-keyed dictionary view is maintained alongside the list (see L{by_name}) so that
+    lookups by name don't require a linear scan."""
 
     def __init__(self):
         self.list = []
+        self.by_name = {}
 
     def append(self, element):
         """
@@ -1412,6 +1466,7 @@ class _indilist(list):
                     deleted = 1
                     break
         self.list.append(element)
+        self.by_name[element.name] = element
 
 
 class _blocking_indi_object_handler:
@@ -1880,6 +1935,9 @@ class bigindiclient(object):
         self.expat.CharacterDataHandler = self._char_data
         self.expat.Parse('<?xml version="1.5" encoding="UTF-8"?> <doc>', 0)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # INDI commands are tiny XML snippets; without TCP_NODELAY, Nagle's algorithm
+        # can hold them back up to 40 ms waiting for the server's delayed ACK
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.settimeout(2)
         self.socket.connect((host, port))
         self.host = host
@@ -1888,6 +1946,11 @@ class bigindiclient(object):
         self.receive_event_queue = queue.Queue()
         self.running_queue = queue.Queue()
         self.receive_vector_queue = queue.Queue()
+        self._vector_ready = threading.Event()
+        self._blob_waiters = {}
+        self._recv_buf = bytearray(1000000)
+        self._blob_decoded = None
+        self._blob_carry = ""
         self.timeout = 1
         self.blob_def_handler = self._default_def_handler
         self.number_def_handler = self._default_def_handler
@@ -1955,6 +2018,7 @@ class bigindiclient(object):
             failed = False
             try:
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.socket.settimeout(0.1)
                 self.socket.connect((self.host, self.port))
                 self.socket.send("<getProperties version='1.5'/>".encode("utf8"))
@@ -2032,10 +2096,34 @@ class bigindiclient(object):
         self.running = True
         while self.running:
             self._receive()
-            while self.running_queue.empty() is False:
-                self.running = self.running_queue.get()
+            while True:
+                try:
+                    self.running = self.running_queue.get_nowait()
+                except queue.Empty:
+                    break
                 self.running_queue.task_done()
 
+    def fileno(self):
+        """
+        Returns the file descriptor of the socket connected to the INDI server. This allows
+        an indiclient instance to be registered directly with C{select}/C{selectors}.
+        @return: the file descriptor of the client socket
+        @rtype: IntType
+        """
+        return self.socket.fileno()
+
+    def wait_for_vector(self, timeout=None):
+        """
+        Blocks until the receiver thread has queued at least one new vector or message,
+        or until L{timeout} seconds have passed. Avoids fixed-interval polling of the
+        receive queues.
+        @param timeout: The maximum number of seconds to wait, B{None} to wait forever
+        @type timeout: FloatType
+        @return: C{True} if a new vector arrived, C{False} if the wait timed out
+        @rtype: BooleanType
+        """
+        return self._vector_ready.wait(timeout)
+
     def send_vector(self, vector):
         """
         Sends an INDI vector to the INDI server.
@@ -2050,6 +2138,99 @@ class bigindiclient(object):
         self.socket.send(data.encode("utf8"))
         vector._light._set_value("Busy")
 
+    def wait_for_vector_ok(self, vector, timeout=5.0):
+        """
+        Blocks until the state of the given vector turns C{Ok}, meaning the server has
+        finished the operation requested by sending it. Unlike
+        L{indivector.wait_for_ok_timeout} this does not sleep on a fixed check
+        interval: it drains the receive queue itself and then blocks until the receiver
+        thread signals new data, so it wakes as soon as the state change arrives and
+        can be called from the same thread that sent the vector.
+        @param vector:  The vector whose state to wait on
+        @type vector: L{indivector}
+        @param timeout: Maximum number of seconds to wait
+        @type timeout: FloatType
+        @return: C{True} once the state is C{Ok}, C{False} if the timeout expired first
+        @rtype: BooleanType
+        """
+        t = time.time()
+        while True:
+            self._vector_ready.clear()
+            self.process_receive_vector_queue()
+            if vector._light.is_ok():
+                return True
+            remaining = timeout - (time.time() - t)
+            if remaining <= 0.0:
+                return False
+            self.wait_for_vector(timeout=remaining)
+
+    def register_blob_waiter(self, devicename, vectorname=None):
+        """
+        Registers interest in the next BLOB update sent by the given device. The
+        receiver thread hands a matching BLOB vector straight to the waiter instead of
+        queueing it on the general event queue, so the waiting thread wakes for exactly
+        the vector it cares about rather than scanning every incoming event.
+        @param devicename:  The name of the device
+        @type devicename: StringType
+        @param vectorname:  The name of the BLOB vector, or C{None} to match any BLOB
+        vector sent by the device
+        @type vectorname: StringType
+        @return: The waiter to be passed to L{wait_for_blob}
+        @rtype: ListType
+        """
+        waiter = [threading.Event(), None]
+        self._blob_waiters[(devicename, vectorname)] = waiter
+        return waiter
+
+    def wait_for_blob(self, waiter, timeout=None):
+        """
+        Blocks until the BLOB vector registered with L{register_blob_waiter} has been
+        received, or the timeout expires.
+        @param waiter:  The waiter returned by L{register_blob_waiter}
+        @type waiter: ListType
+        @param timeout: Maximum number of seconds to wait, or C{None} to wait forever
+        @type timeout: FloatType
+        @return: The BLOB vector received, or C{None} on timeout
+        @rtype: L{indivector}
+        """
+        waiter[0].wait(timeout)
+        return waiter[1]
+
+    def unregister_blob_waiter(self, devicename, vectorname=None):
+        """
+        Removes a waiter previously installed with L{register_blob_waiter}.
+        @param devicename:  The name of the device
+        @type devicename: StringType
+        @param vectorname:  The name the waiter was registered under
+        @type vectorname: StringType
+        @return: B{None}
+        @rtype: NoneType
+        """
+        self._blob_waiters.pop((devicename, vectorname), None)
+
+    def send_vectors(self, vectors):
+        """
+        Sends several INDI vectors to the INDI server with a single socket write, so a
+        burst of short commands leaves in one TCP segment instead of paying one write
+        (and potentially one round-trip) per vector.
+        @param vectors:  The INDI vectors to be send, C{None} entries are skipped
+        @type vectors: a sequence of L{indivector}
+        @return: B{None}
+        @rtype: NoneType
+        """
+        data = ""
+        sent = []
+        for vector in vectors:
+            if (vector is None) or (not vector.tag.is_vector()):
+                continue
+            data = data + vector.get_xml(inditransfertypes.inew)
+            sent.append(vector)
+        if not sent:
+            return
+        self.socket.sendall(data.encode("utf8"))
+        for vector in sent:
+            vector._light._set_value("Busy")
+
     def wait_until_vector_available(self, devicename, vectorname):
         """
         Looks if the requested vector has already been received and waits until it is received otherwise
@@ -2067,8 +2248,11 @@ class bigindiclient(object):
         Process the entries form the receive_vector_queue created
         by the parsing thread and update the self.indivector.list
         """
-        while self.receive_vector_queue.empty() is False:
-            newVector = self.receive_vector_queue.get()
+        while True:
+            try:
+                newVector = self.receive_vector_queue.get_nowait()
+            except queue.Empty:
+                break
             devicename = newVector.getDevice()
             vectorname = newVector.getName()
             got = False
@@ -2077,7 +2261,7 @@ class bigindiclient(object):
                     vector.updateByVector(newVector)
                     got = True
             if not got:
-                self.indivectors.list.append(newVector)
+                self.indivectors.append(newVector)
             self.receive_vector_queue.task_done()
 
     def _get_vector(self, devicename, vectorname):
@@ -2086,6 +2270,21 @@ class bigindiclient(object):
                 return vector
         return None
 
+    def drain_event_queue(self):
+        """
+        Removes all events currently waiting in the L{receive_event_queue} and returns
+        them as a list. The queue lock is taken only once, instead of once per event as
+        repeated C{get_nowait()} calls would, so callers scanning many queued vectors
+        (e.g. while waiting for a BLOB) pay a single critical section per drain.
+        @return: The queued events, oldest first
+        @rtype: ListType
+        """
+        eventqueue = self.receive_event_queue
+        with eventqueue.mutex:
+            events = list(eventqueue.queue)
+            eventqueue.queue.clear()
+        return events
+
     def get_vector(self, devicename, vectorname):
         """
         Returns an L{indivector} matching the given L{devicename} and L{vectorname}
@@ -2102,11 +2301,14 @@ class bigindiclient(object):
         while True:
             v = self._get_vector(devicename, vectorname)
             if v is None:
-                time.sleep(0.01)
+                self._vector_ready.clear()
                 self.process_receive_vector_queue()
                 v = self._get_vector(devicename, vectorname)
                 if v is not None:
                     return v
+                remaining = self.timeout - (time.time() - t)
+                if remaining > 0:
+                    self.wait_for_vector(timeout=remaining)
             else:
                 return v
             if ((time.time() - t) > self.timeout):
@@ -2296,8 +2498,11 @@ class bigindiclient(object):
         """
         self.process_receive_vector_queue()
         try:
-            while self.receive_event_queue.empty() is False:
-                vector = self.receive_event_queue.get()
+            while True:
+                try:
+                    vector = self.receive_event_queue.get_nowait()
+                except queue.Empty:
+                    break
                 if not vector.tag.is_message():
                     vector = self.get_vector(vector.device, vector.name)
                 if vector.is_valid:
@@ -2341,17 +2546,20 @@ class bigindiclient(object):
             raise Exception("indiclient: Error during process events: {e}")
 
     def _receive(self):
-        """receive data from the server
+        """receive data from the server. The socket writes into a receive buffer that is
+        reused across calls, so no fresh megabyte-sized bytes object is allocated per
+        read while a large BLOB streams in.
         @return: B{None}
         @rtype: NoneType
         """
         try:
-            data = self.socket.recv(1000000)
+            nbytes = self.socket.recv_into(self._recv_buf)
         except Exception:
-            data = ""
-        if data != "":
+            nbytes = 0
+        if nbytes:
+            data = memoryview(self._recv_buf)[:nbytes]
             if self.verbose:
-                log.debug(data)
+                log.debug(bytes(data))
             parseval = self.expat.Parse(data, 0)
         else:
             parseval = None
@@ -2369,6 +2577,18 @@ class bigindiclient(object):
             return None
         if self.currentVector is None:
             return None
+        if self._blob_decoded is not None:
+            # stream the base64 payload into binary as it arrives instead of
+            # accumulating the whole encoded text; decode whatever prefix is
+            # 4-aligned and carry the remainder into the next chunk
+            carry = self._blob_carry + "".join(data.split())
+            usable = len(carry) & ~3
+            if usable:
+                self._blob_decoded += binascii.a2b_base64(carry[:usable])
+                self._blob_carry = carry[usable:]
+            else:
+                self._blob_carry = carry
+            return None
         self.currentData += data
 
     def _end_element(self, name):
@@ -2385,15 +2605,34 @@ class bigindiclient(object):
         self.currentVector.port = self.port
         if self.currentElement is not None:
             if self.currentElement.tag.get_initial_tag() == name:
-                string_currentData = "".join(self.currentData).replace('\\n', '').strip()
-                self.currentElement._set_value(string_currentData)
+                if self._blob_decoded is not None:
+                    if self._blob_carry:
+                        self._blob_decoded += binascii.a2b_base64(self._blob_carry)
+                        self._blob_carry = ""
+                    self.currentElement._set_data(bytes(self._blob_decoded))
+                    self._blob_decoded = None
+                else:
+                    string_currentData = "".join(self.currentData).replace('\\n', '').strip()
+                    self.currentElement._set_value(string_currentData)
                 self.currentVector.elements.append(self.currentElement)
                 self.currentElement = None
                 self.currentData = None
         if self.currentVector.tag.get_initial_tag() == name:
-            self.receive_event_queue.put(self.currentVector)
-            self.receive_vector_queue.put(self.currentVector)
+            vector = self.currentVector
             self.currentVector = None
+            if (vector.tag.get_type() == "BLOBVector") and (vector.tag.get_transfertype() == inditransfertypes.iset):
+                waiter = self._blob_waiters.get((vector.device, vector.name)) or self._blob_waiters.get((vector.device, None))
+                if waiter is not None:
+                    # deliver the BLOB straight to the registered waiter; it does not
+                    # go through the general event queue
+                    waiter[1] = vector
+                    waiter[0].set()
+                    self.receive_vector_queue.put(vector)
+                    self._vector_ready.set()
+                    return
+            self.receive_event_queue.put(vector)
+            self.receive_vector_queue.put(vector)
+            self._vector_ready.set()
 
     def _start_element(self, name, attrs):
         """
@@ -2411,6 +2650,7 @@ class bigindiclient(object):
             return
         if 'message' in attrs:
             self.receive_event_queue.put(indimessage(attrs))
+            self._vector_ready.set()
         if obj.tag.is_vector():
             if obj.tag.get_transfertype() in (inditransfertypes.idef, inditransfertypes.iset):
                 self.currentVector = obj
@@ -2419,6 +2659,10 @@ class bigindiclient(object):
                 if self.currentVector.tag.get_transfertype() in (inditransfertypes.idef, inditransfertypes.iset):
                     self.currentElement = obj
         self.currentData = []
+        # BLOB payloads are base64-decoded on the fly in _char_data rather than
+        # collected as text
+        self._blob_decoded = bytearray() if type(self.currentElement) is indiblob else None
+        self._blob_carry = ""
 
     def enable_blob(self):
         """
@@ -2498,6 +2742,26 @@ class indiclient(bigindiclient):
             self.send_vector(vector)
         return vector
 
+    def set_and_send_floats(self, devicename, vectorname, valuedict):
+        """
+        Sets the values of several elements of the same vector by floating point numbers,
+        and sends them to the server in a single message
+        @param devicename:  The name of the device
+        @type devicename: StringType
+        @param vectorname:  The name of the vector
+        @type vectorname: StringType
+        @param valuedict:  A mapping of element names to the numbers to be set.
+        @type valuedict: DictType
+        @return: The vector containing the elements that were just sent.
+        @rtype: L{indivector}
+        """
+        vector = self.get_vector(devicename, vectorname)
+        if vector is not None:
+            for elementname, number in valuedict.items():
+                vector.get_element(elementname).set_float(number)
+            self.send_vector(vector)
+        return vector
+
     def set_and_send_switchvector_by_elementlabel(self, devicename, vectorname, elementlabel):
         """
         Sets all L{indiswitch} elements in this vector to C{Off}. And sets the one matching the given L{elementlabel}
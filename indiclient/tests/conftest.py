@@ -0,0 +1,17 @@
+# Licensed under GPL3 (see LICENSE)
+# coding=utf-8
+
+import pytest
+
+from indiclient.indicam import CCDCam
+
+
+@pytest.fixture(scope="module")
+def cam():
+    """
+    Camera client shared by all tests in a module so each test doesn't pay the
+    multi-second connect/configure cost of building its own.
+    """
+    c = CCDCam("localhost", 7624)
+    yield c
+    c.quit()